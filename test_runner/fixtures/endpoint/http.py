@@ -1,9 +1,11 @@
 from __future__ import annotations
 
-import urllib.parse
+import json
+from typing import Any
 
 import requests
 from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 class EndpointHttpClient(requests.Session):
@@ -13,25 +15,57 @@ class EndpointHttpClient(requests.Session):
     ):
         super().__init__()
         self.port = port
+        self.base_url = f"http://localhost:{port}"
 
-        self.mount("http://", HTTPAdapter())
+        # Build the endpoint URLs once instead of formatting them on every call
+        self._dbs_and_roles_url = f"{self.base_url}/dbs_and_roles"
+        self._database_schema_url = f"{self.base_url}/database_schema"
+        self._installed_extensions_url = f"{self.base_url}/installed_extensions"
+        self._extensions_url = f"{self.base_url}/extensions"
+        self._grants_url = f"{self.base_url}/grants"
+        self._metrics_url = f"{self.base_url}/metrics"
+        self._failpoints_url = f"{self.base_url}/failpoints"
+
+        # Responses are small and come from localhost, compressing them is a waste of time
+        self.headers["Accept-Encoding"] = "identity"
+        # Likewise, there is no proxy or netrc to look up in the environment on every request
+        self.trust_env = False
+
+        # All requests go to the same compute_ctl, so keep a single keep-alive
+        # connection pool for it instead of reconnecting on every call.
+        retries = Retry(
+            total=3,
+            backoff_factor=0.05,
+            status_forcelist=(502, 503, 504),
+            # Hand the last response back to the caller, so that raise_for_status()
+            # reports the actual HTTP error rather than a urllib3 RetryError
+            raise_on_status=False,
+        )
+        self.mount(
+            "http://",
+            HTTPAdapter(pool_connections=1, pool_maxsize=32, pool_block=True, max_retries=retries),
+        )
+
+    @staticmethod
+    def _parse_json(res: requests.Response) -> Any:
+        # compute_ctl always responds with UTF-8 JSON: parse the raw body and skip
+        # the encoding detection of Response.json()
+        return json.loads(res.content)
 
     def dbs_and_roles(self):
-        res = self.get(f"http://localhost:{self.port}/dbs_and_roles")
+        res = self.get(self._dbs_and_roles_url)
         res.raise_for_status()
-        return res.json()
+        return self._parse_json(res)
 
     def database_schema(self, database: str):
-        res = self.get(
-            f"http://localhost:{self.port}/database_schema?database={urllib.parse.quote(database, safe='')}"
-        )
+        res = self.get(self._database_schema_url, params={"database": database})
         res.raise_for_status()
         return res.text
 
     def installed_extensions(self):
-        res = self.get(f"http://localhost:{self.port}/installed_extensions")
+        res = self.get(self._installed_extensions_url)
         res.raise_for_status()
-        return res.json()
+        return self._parse_json(res)
 
     def extensions(self, extension: str, version: str, database: str):
         body = {
@@ -39,20 +73,20 @@ class EndpointHttpClient(requests.Session):
             "version": version,
             "database": database,
         }
-        res = self.post(f"http://localhost:{self.port}/extensions", json=body)
+        res = self.post(self._extensions_url, json=body)
         res.raise_for_status()
-        return res.json()
+        return self._parse_json(res)
 
     def set_role_grants(self, database: str, role: str, schema: str, privileges: list[str]):
         res = self.post(
-            f"http://localhost:{self.port}/grants",
+            self._grants_url,
             json={"database": database, "schema": schema, "role": role, "privileges": privileges},
         )
         res.raise_for_status()
-        return res.json()
+        return self._parse_json(res)
 
     def metrics(self) -> str:
-        res = self.get(f"http://localhost:{self.port}/metrics")
+        res = self.get(self._metrics_url)
         res.raise_for_status()
         return res.text
 
@@ -67,5 +101,5 @@ class EndpointHttpClient(requests.Session):
                 }
             )
 
-        res = self.post(f"http://localhost:{self.port}/failpoints", json=body)
+        res = self.post(self._failpoints_url, json=body)
         res.raise_for_status()
@@ -11,6 +11,7 @@ import shutil
 import subprocess
 import threading
 import time
+import tomllib
 import uuid
 from collections import defaultdict
 from collections.abc import Iterable, Iterator
@@ -95,7 +96,9 @@ from fixtures.utils import (
     allure_add_grafana_links,
     assert_no_errors,
     get_dir_size,
+    load_toml_cached,
     print_gc_result,
+    reflink_or_copy,
     size_to_bytes,
     subprocess_capture,
     wait_until,
@@ -584,9 +587,8 @@ class NeonEnvBuilder:
         """
 
         # Get the initial tenant and timeline from the snapshot config
-        snapshot_config_toml = repo_dir / "config"
-        with snapshot_config_toml.open("r") as f:
-            snapshot_config = toml.load(f)
+        # The same snapshot is imported by many tests, only parse its config once
+        snapshot_config = load_toml_cached(repo_dir / "config")
 
         self.initial_tenant = TenantId(snapshot_config["default_tenant_id"])
         self.initial_timeline = TimelineId(
@@ -596,54 +598,94 @@ class NeonEnvBuilder:
         )
         self.env = self.init_configs()
 
-        for ps_dir in repo_dir.glob("pageserver_*"):
-            tenants_from_dir = ps_dir / "tenants"
-            tenants_to_dir = self.repo_dir / ps_dir.name / "tenants"
+        # The directories below are disjoint, and copying them is dominated by file I/O,
+        # so run the copies concurrently.
+        futs = []
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            for ps_dir in list_subdirs(repo_dir, "pageserver_"):
+                tenants_from_dir = ps_dir / "tenants"
+                tenants_to_dir = self.repo_dir / ps_dir.name / "tenants"
 
+                if self.test_overlay_dir is None:
+                    log.info(
+                        f"Copying pageserver tenants directory {tenants_from_dir} to {tenants_to_dir}"
+                    )
+                    futs.append(
+                        executor.submit(
+                            shutil.copytree,
+                            tenants_from_dir,
+                            tenants_to_dir,
+                            copy_function=reflink_or_copy,
+                        )
+                    )
+                else:
+                    log.info(
+                        f"Creating overlayfs mount of pageserver tenants directory {tenants_from_dir} to {tenants_to_dir}"
+                    )
+                    self.overlay_mount(f"{ps_dir.name}:tenants", tenants_from_dir, tenants_to_dir)
+
+            for sk_from_dir in list_subdirs(repo_dir / "safekeepers", "sk"):
+                sk_to_dir = self.repo_dir / "safekeepers" / sk_from_dir.name
+                log.info(f"Copying safekeeper directory {sk_from_dir} to {sk_to_dir}")
+                sk_to_dir.rmdir()
+                futs.append(
+                    executor.submit(
+                        shutil.copytree,
+                        sk_from_dir,
+                        sk_to_dir,
+                        ignore=shutil.ignore_patterns("*.log", "*.pid"),
+                        copy_function=reflink_or_copy,
+                    )
+                )
+
+            shutil.rmtree(self.repo_dir / "local_fs_remote_storage", ignore_errors=True)
             if self.test_overlay_dir is None:
-                log.info(
-                    f"Copying pageserver tenants directory {tenants_from_dir} to {tenants_to_dir}"
+                log.info("Copying local_fs_remote_storage directory from snapshot")
+                futs.append(
+                    executor.submit(
+                        shutil.copytree,
+                        repo_dir / "local_fs_remote_storage",
+                        self.repo_dir / "local_fs_remote_storage",
+                        copy_function=reflink_or_copy,
+                    )
                 )
-                shutil.copytree(tenants_from_dir, tenants_to_dir)
             else:
                 log.info(
-                    f"Creating overlayfs mount of pageserver tenants directory {tenants_from_dir} to {tenants_to_dir}"
+                    "Creating overlayfs mount of local_fs_remote_storage directory from snapshot"
+                )
+                self.overlay_mount(
+                    "local_fs_remote_storage",
+                    repo_dir / "local_fs_remote_storage",
+                    self.repo_dir / "local_fs_remote_storage",
                 )
-                self.overlay_mount(f"{ps_dir.name}:tenants", tenants_from_dir, tenants_to_dir)
-
-        for sk_from_dir in (repo_dir / "safekeepers").glob("sk*"):
-            sk_to_dir = self.repo_dir / "safekeepers" / sk_from_dir.name
-            log.info(f"Copying safekeeper directory {sk_from_dir} to {sk_to_dir}")
-            sk_to_dir.rmdir()
-            shutil.copytree(sk_from_dir, sk_to_dir, ignore=shutil.ignore_patterns("*.log", "*.pid"))
 
-        shutil.rmtree(self.repo_dir / "local_fs_remote_storage", ignore_errors=True)
-        if self.test_overlay_dir is None:
-            log.info("Copying local_fs_remote_storage directory from snapshot")
-            shutil.copytree(
-                repo_dir / "local_fs_remote_storage", self.repo_dir / "local_fs_remote_storage"
+            # restore storage controller (the db is small, don't bother with overlayfs)
+            storcon_db_from_dir = repo_dir / "storage_controller_db"
+            storcon_db_to_dir = self.repo_dir / "storage_controller_db"
+            log.info(
+                f"Copying storage_controller_db from {storcon_db_from_dir} to {storcon_db_to_dir}"
             )
-        else:
-            log.info("Creating overlayfs mount of local_fs_remote_storage directory from snapshot")
-            self.overlay_mount(
-                "local_fs_remote_storage",
-                repo_dir / "local_fs_remote_storage",
-                self.repo_dir / "local_fs_remote_storage",
+            assert storcon_db_from_dir.is_dir()
+            assert not storcon_db_to_dir.exists()
+
+            def ignore_postgres_log(path: str, _names):
+                if Path(path) == storcon_db_from_dir:
+                    return {"postgres.log"}
+                return set()
+
+            futs.append(
+                executor.submit(
+                    shutil.copytree,
+                    storcon_db_from_dir,
+                    storcon_db_to_dir,
+                    ignore=ignore_postgres_log,
+                    copy_function=reflink_or_copy,
+                )
             )
 
-        # restore storage controller (the db is small, don't bother with overlayfs)
-        storcon_db_from_dir = repo_dir / "storage_controller_db"
-        storcon_db_to_dir = self.repo_dir / "storage_controller_db"
-        log.info(f"Copying storage_controller_db from {storcon_db_from_dir} to {storcon_db_to_dir}")
-        assert storcon_db_from_dir.is_dir()
-        assert not storcon_db_to_dir.exists()
-
-        def ignore_postgres_log(path: str, _names):
-            if Path(path) == storcon_db_from_dir:
-                return {"postgres.log"}
-            return set()
+        for f in futs:
+            f.result()
 
-        shutil.copytree(storcon_db_from_dir, storcon_db_to_dir, ignore=ignore_postgres_log)
         assert not (storcon_db_to_dir / "postgres.log").exists()
         # NB: neon_local rewrites postgresql.conf on each start based on neon_local config. No need to patch it.
         # However, in this new NeonEnv, the pageservers listen on different ports, and the storage controller
@@ -657,8 +699,8 @@ class NeonEnvBuilder:
         patch_script_path.write_text(patch_script)
 
         # Update the config with info about tenants and timelines
-        with (self.repo_dir / "config").open("r") as f:
-            config = toml.load(f)
+        with (self.repo_dir / "config").open("rb") as f:
+            config = tomllib.load(f)
 
         config["default_tenant_id"] = snapshot_config["default_tenant_id"]
         config["branch_name_mappings"] = snapshot_config["branch_name_mappings"]
@@ -1606,7 +1648,7 @@ class LogUtils:
         self.logfile = logfile
 
     def assert_log_contains(
-        self, pattern: str, offset: None | LogCursor = None
+        self, pattern: str | re.Pattern[str], offset: None | LogCursor = None
     ) -> tuple[str, LogCursor]:
         """Convenient for use inside wait_until()"""
 
@@ -1615,13 +1657,28 @@ class LogUtils:
         return res
 
     def log_contains(
-        self, pattern: str, offset: None | LogCursor = None
+        self, pattern: str | re.Pattern[str], offset: None | LogCursor = None
     ) -> tuple[str, LogCursor] | None:
         """Check that the log contains a line that matches the given regex"""
+        line, cursor = self.log_tail_contains(pattern, offset)
+        if line is None:
+            return None
+        return (line, cursor)
+
+    def log_tail_contains(
+        self, pattern: str | re.Pattern[str], offset: None | LogCursor = None
+    ) -> tuple[str | None, LogCursor]:
+        """
+        Like log_contains(), but if there is no match, return the cursor up to which the
+        log was scanned. Passing that back in only scans the lines appended since then,
+        which keeps polling a large log inside wait_until() cheap. A trailing line without
+        a newline is searched too, but not skipped by the returned cursor.
+        """
+        start = LogCursor(0) if offset is None else offset
         logfile = self.logfile
         if not logfile.exists():
             log.warning(f"Skipping log check: {logfile} does not exist")
-            return None
+            return (None, start)
 
         contains_re = re.compile(pattern)
 
@@ -1630,20 +1687,20 @@ class LogUtils:
         # no guarantee it is already present in the log file. This hasn't
         # been a problem in practice, our python tests are not fast enough
         # to hit that race condition.
-        skip_until_line_no = 0 if offset is None else offset._line_no
-        cur_line_no = 0
-        with logfile.open("r") as f:
-            for line in f:
-                if cur_line_no < skip_until_line_no:
-                    cur_line_no += 1
-                    continue
-                elif contains_re.search(line):
+        pos = start._byte_offset
+        with logfile.open("rb") as f:
+            f.seek(pos)
+            for raw in f:
+                line = raw.decode("utf-8", errors="replace")
+                if contains_re.search(line):
                     # found it!
-                    cur_line_no += 1
-                    return (line, LogCursor(cur_line_no))
-                else:
-                    cur_line_no += 1
-        return None
+                    return (line, LogCursor(pos + len(raw)))
+                if not raw.endswith(b"\n"):
+                    # A partially written last line: search it, but rescan it next time,
+                    # the rest of it may still be on the way.
+                    break
+                pos += len(raw)
+        return (None, LogCursor(pos))
 
 
 class StorageControllerApiException(Exception):
@@ -2477,14 +2534,14 @@ class NeonProxiedStorageController(NeonStorageController):
             )
 
     def log_contains(
-        self, pattern: str, offset: None | LogCursor = None
+        self, pattern: str | re.Pattern[str], offset: None | LogCursor = None
     ) -> tuple[str, LogCursor] | None:
         raise NotImplementedError()
 
 
 @dataclass
 class LogCursor:
-    _line_no: int
+    _byte_offset: int
 
 
 class NeonPageserver(PgProtocol, LogUtils):
@@ -3825,12 +3882,21 @@ class Endpoint(PgProtocol, LogUtils):
         # potentially by some __del__ chains in other threads.
         self._running = threading.Semaphore(0)
 
-    def http_client(
-        self, auth_token: str | None = None, retries: Retry | None = None
-    ) -> EndpointHttpClient:
-        return EndpointHttpClient(
-            port=self.http_port,
-        )
+        self._http_client: EndpointHttpClient | None = None
+
+    def http_client(self) -> EndpointHttpClient:
+        """
+        Returns this endpoint's HTTP client. It is created on first use and kept until the
+        endpoint is stopped, so that its connections to compute_ctl are reused across calls.
+        """
+        if self._http_client is None:
+            self._http_client = EndpointHttpClient(self.http_port)
+        return self._http_client
+
+    def _close_http_client(self):
+        if self._http_client is not None:
+            self._http_client.close()
+            self._http_client = None
 
     def create(
         self,
@@ -4117,6 +4183,7 @@ class Endpoint(PgProtocol, LogUtils):
                 cli = sk.http_client()
                 wait_walreceivers_absent(cli, self.tenant_id, sks_wait_walreceiver_gone[1])
 
+        self._close_http_client()
         return self
 
     def stop_and_destroy(self, mode: str = "immediate") -> Self:
@@ -4133,6 +4200,7 @@ class Endpoint(PgProtocol, LogUtils):
             )
             self.endpoint_id = None
 
+        self._close_http_client()
         return self
 
     def create_start(
@@ -4864,6 +4932,17 @@ SKIP_FILES = frozenset(
 )
 
 
+def list_subdirs(path: Path, prefix: str) -> list[Path]:
+    """
+    Returns the directories directly under `path` whose name starts with `prefix`.
+    A single scandir pass, file types come from the directory listing without extra stat calls.
+    """
+    with os.scandir(path) as it:
+        return sorted(
+            Path(entry.path) for entry in it if entry.name.startswith(prefix) and entry.is_dir()
+        )
+
+
 def should_skip_dir(dirname: str) -> bool:
     return dirname in SKIP_DIRS
 
@@ -272,6 +272,10 @@ class PageserverHttpClient(requests.Session, MetricsGetter):
 
         self.mount("http://", HTTPAdapter(max_retries=retries))
 
+        # We only ever talk to localhost: don't let requests look up proxy settings
+        # and netrc from the environment on every request.
+        self.trust_env = False
+
         if auth_token is not None:
             self.headers["Authorization"] = f"Bearer {auth_token}"
 
@@ -26,6 +26,7 @@ if TYPE_CHECKING:
 
 TIMELINE_INDEX_PART_FILE_NAME = "index_part.json"
 TENANT_HEATMAP_FILE_NAME = "heatmap-v1.json"
+TENANT_MANIFEST_PREFIX = "tenant-manifest"
 
 
 @enum.unique
@@ -313,6 +314,35 @@ class S3Storage:
         r = self.client.get_object(Bucket=self.bucket_name, Key=self.heatmap_key(tenant_id))
         return json.loads(r["Body"].read().decode("utf-8"))
 
+    def get_latest_tenant_manifest_key(self, tenant_id: TenantId | TenantShardId) -> str:
+        """
+        Gets the key of the tenant manifest with the highest generation.
+
+        @param tenant_id: tenant (shard) whose manifests to look at.
+        """
+        prefix = f"{self.tenant_path(tenant_id)}/{TENANT_MANIFEST_PREFIX}"
+        response = self.client.list_objects_v2(Bucket=self.bucket_name, Prefix=prefix)
+        manifest_keys = [obj["Key"] for obj in response.get("Contents", [])]
+        assert len(manifest_keys) > 0, f"no tenant manifest found under {prefix}"
+
+        def parse_gen(manifest_key: str) -> int:
+            m = re.search(rf"{TENANT_MANIFEST_PREFIX}-([0-9a-f]{{8}})\.json$", manifest_key)
+            return int(m.group(1), base=16) if m is not None else -1
+
+        return max(manifest_keys, key=parse_gen)
+
+    def download_tenant_manifest(self, tenant_id: TenantId | TenantShardId) -> Any:
+        """
+        Downloads the content of the latest tenant manifest from remote storage.
+
+        @param tenant_id: tenant (shard) whose manifest to download.
+        """
+        manifest_key = self.get_latest_tenant_manifest_key(tenant_id)
+        response = self.client.get_object(Bucket=self.bucket_name, Key=manifest_key)
+        body = response["Body"].read().decode("utf-8")
+        log.info(f"{manifest_key}: {body}")
+        return json.loads(body)
+
     def mock_remote_tenant_path(self, tenant_id: TenantId):
         assert self.real is False
 
@@ -1,14 +1,19 @@
 from __future__ import annotations
 
 import contextlib
+import copy
 import dataclasses
+import fcntl
+import functools
 import json
 import os
 import re
+import shutil
 import subprocess
 import tarfile
 import threading
 import time
+import tomllib
 from collections.abc import Callable, Iterable
 from datetime import datetime, timedelta
 from hashlib import sha256
@@ -228,6 +233,54 @@ def get_dir_size(path: Path) -> int:
     return totalbytes
 
 
+@functools.lru_cache(maxsize=64)
+def _parse_toml_file(path: str, mtime_ns: int, size: int) -> dict[str, Any]:
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+
+def load_toml_cached(path: Path) -> dict[str, Any]:
+    """
+    Parses a TOML file, reusing the result of previous parses of the file as long as its
+    size and mtime haven't changed. Returns a copy, so callers are free to modify it.
+    """
+    st = path.stat()
+    return copy.deepcopy(_parse_toml_file(str(path), st.st_mtime_ns, st.st_size))
+
+
+# FICLONE ioctl request from linux/fs.h
+FICLONE = 0x40049409
+
+
+def reflink_or_copy(src: str, dst: str) -> str:
+    """
+    A `copy_function` for shutil.copytree() that clones the file instead of copying its data
+    on filesystems which support copy-on-write extents (btrfs, XFS, ...), so the copy is
+    cheap and still independent of the source. Falls back to shutil.copy2() otherwise.
+    """
+    try:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except OSError:
+        return shutil.copy2(src, dst)
+
+    shutil.copystat(src, dst)
+    return dst
+
+
+def link_or_copy(src: str, dst: str) -> str:
+    """
+    A `copy_function` for shutil.copytree() that hardlinks the file, falling back to
+    shutil.copy2() e.g. when crossing filesystems. Only suitable for files that nobody
+    modifies in place afterwards, as the source and the copy share their data.
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        return shutil.copy2(src, dst)
+    return dst
+
+
 def get_timeline_dir_size(path: Path) -> int:
     """Get the timeline directory's total size, which only counts the layer files' size."""
     sz = 0
@@ -405,10 +458,15 @@ def wait_until(
     timeout: float = 20.0,  # seconds
     interval: float = 0.5,  # seconds
     status_interval: float = 1.0,  # seconds
+    max_interval: float | None = None,  # seconds
 ) -> WaitUntilRet:
     """
     Wait until 'func' returns successfully, without exception. Returns the
     last return value from the function.
+
+    If 'max_interval' is set, the interval doubles after every failed attempt up to
+    'max_interval': this allows to start polling with a short interval for conditions
+    that are usually met quickly, without hammering the system if they aren't.
     """
     if name is None:
         name = getattr(func, "__name__", repr(func))
@@ -424,6 +482,8 @@ def wait_until(
                 next_status = datetime.now() + timedelta(seconds=status_interval)
             last_exception = e
             time.sleep(interval)
+            if max_interval is not None:
+                interval = min(interval * 2, max_interval)
     raise Exception(f"timed out while waiting for {name}") from last_exception
 
 
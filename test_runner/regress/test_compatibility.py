@@ -1,16 +1,17 @@
 from __future__ import annotations
 
+import filecmp
 import os
 import re
 import shutil
 import subprocess
 import tempfile
+import tomllib
 from dataclasses import dataclass
 from pathlib import Path
 
 import fixtures.utils
 import pytest
-import toml
 from fixtures.common_types import TenantId, TimelineId
 from fixtures.log_helper import log
 from fixtures.neon_fixtures import (
@@ -25,6 +26,7 @@ from fixtures.pageserver.utils import (
 )
 from fixtures.pg_version import PgVersion
 from fixtures.remote_storage import RemoteStorageKind, S3Storage, s3_storage
+from fixtures.utils import link_or_copy
 from fixtures.workload import Workload
 
 #
@@ -123,6 +125,14 @@ check_ondisk_data_compatibility_if_enabled = pytest.mark.skipif(
     reason="CHECK_ONDISK_DATA_COMPATIBILITY env is not set",
 )
 
+# If the breakage is intentional, the tests can be xfailed, see the comment at the top of the file
+ALLOW_BACKWARD_COMPATIBILITY_BREAKAGE = (
+    os.environ.get("ALLOW_BACKWARD_COMPATIBILITY_BREAKAGE", "false").lower() == "true"
+)
+ALLOW_FORWARD_COMPATIBILITY_BREAKAGE = (
+    os.environ.get("ALLOW_FORWARD_COMPATIBILITY_BREAKAGE", "false").lower() == "true"
+)
+
 
 @pytest.mark.xdist_group("compatibility")
 @pytest.mark.order(before="test_forward_compatibility")
@@ -157,7 +167,8 @@ def test_create_snapshot(
         ["pg_dumpall", f"--dbname={endpoint.connstr()}", f"--file={test_output_dir / 'dump.sql'}"]
     )
 
-    snapshot_config = toml.load(test_output_dir / "repo" / "config")
+    with (test_output_dir / "repo" / "config").open("rb") as f:
+        snapshot_config = tomllib.load(f)
     tenant_id = snapshot_config["default_tenant_id"]
     timeline_id = dict(snapshot_config["branch_name_mappings"]["main"])[tenant_id]
 
@@ -173,6 +184,7 @@ def test_create_snapshot(
         sk.stop()
     env.pageserver.stop()
     env.storage_controller.stop()
+    env.broker.stop()
 
     # Directory `compatibility_snapshot_dir` is uploaded to S3 in a workflow, keep the name in sync with it
     compatibility_snapshot_dir = (
@@ -181,10 +193,15 @@ def test_create_snapshot(
     if compatibility_snapshot_dir.exists():
         shutil.rmtree(compatibility_snapshot_dir)
 
+    # The endpoints, safekeepers, pageserver, storage controller (with its database) and
+    # storage broker are all stopped, so nothing writes to the test output directory anymore:
+    # link the files instead of copying their data. Teardown only stops services
+    # that are still running, so it doesn't append to the linked files either.
     shutil.copytree(
         test_output_dir,
         compatibility_snapshot_dir,
         ignore=shutil.ignore_patterns("pg_dynshmem"),
+        copy_function=link_or_copy,
     )
 
 
@@ -204,9 +221,7 @@ def test_backward_compatibility(
     """
     Test that the new binaries can read old data
     """
-    breaking_changes_allowed = (
-        os.environ.get("ALLOW_BACKWARD_COMPATIBILITY_BREAKAGE", "false").lower() == "true"
-    )
+    breaking_changes_allowed = ALLOW_BACKWARD_COMPATIBILITY_BREAKAGE
 
     try:
         neon_env_builder.num_safekeepers = 3
@@ -247,9 +262,7 @@ def test_forward_compatibility(
     """
     Test that the old binaries can read new data
     """
-    breaking_changes_allowed = (
-        os.environ.get("ALLOW_FORWARD_COMPATIBILITY_BREAKAGE", "false").lower() == "true"
-    )
+    breaking_changes_allowed = ALLOW_FORWARD_COMPATIBILITY_BREAKAGE
 
     neon_env_builder.test_may_use_compatibility_snapshot_binaries = True
 
@@ -395,6 +408,7 @@ def dump_differs(
 ) -> bool:
     """
     Runs diff(1) command on two SQL dumps and write the output to the given output file.
+    If the dumps are byte-identical, diff(1) is skipped and the output file is left empty.
     The function supports allowed diffs, if the diff is in the allowed_diffs list, it's not considered as a difference.
     See the example of it in https://github.com/neondatabase/neon/pull/4425/files#diff-15c5bfdd1d5cc1411b9221091511a60dd13a9edf672bdfbb57dd2ef8bb7815d6
 
@@ -406,6 +420,11 @@ def dump_differs(
     if not second.exists():
         raise FileNotFoundError(f"{second} doesn't exist")
 
+    # Fast path for the common case of byte-identical dumps, no need to spawn diff(1)
+    if filecmp.cmp(first, second, shallow=False):
+        output.write_text("")
+        return False
+
     with output.open("w") as stdout:
         res = subprocess.run(
             [
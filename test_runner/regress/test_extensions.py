@@ -8,9 +8,7 @@ def test_extensions(neon_simple_env: NeonEnv):
 
     env = neon_simple_env
 
-    env.create_branch("test_extensions")
-
-    endpoint = env.endpoints.create_start("test_extensions")
+    endpoint = env.endpoints.create_start("main")
     extension = "neon_test_utils"
     database = "test_extensions"
 
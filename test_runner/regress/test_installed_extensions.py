@@ -1,8 +1,9 @@
 from __future__ import annotations
 
 import time
+from collections import defaultdict
 from logging import info
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any
 
 from fixtures.log_helper import log
 from fixtures.metrics import parse_metrics
@@ -11,45 +12,56 @@ if TYPE_CHECKING:
     from fixtures.neon_fixtures import NeonEnv
 
 
+def extensions_by_name(res: dict[str, Any]) -> dict[str, dict[str, dict[str, Any]]]:
+    """
+    Index the installed_extensions response by extension name, then by version:
+    the same extension is listed once per installed version.
+    """
+    by_name: dict[str, dict[str, dict[str, Any]]] = defaultdict(dict)
+    for ext in res["extensions"]:
+        by_name[ext["extname"]][ext["version"]] = ext
+    return by_name
+
+
 def test_installed_extensions(neon_simple_env: NeonEnv):
     """basic test for the endpoint that returns the list of installed extensions"""
 
     env = neon_simple_env
 
-    env.create_branch("test_installed_extensions")
+    endpoint = env.endpoints.create_start("main")
 
-    endpoint = env.endpoints.create_start("test_installed_extensions")
-
-    endpoint.safe_psql("CREATE DATABASE test_installed_extensions")
-    endpoint.safe_psql("CREATE DATABASE test_installed_extensions_2")
+    # CREATE DATABASE can't be part of a multi-statement query, but we can at least
+    # issue both over the same connection
+    endpoint.safe_psql_many(
+        [
+            "CREATE DATABASE test_installed_extensions",
+            "CREATE DATABASE test_installed_extensions_2",
+        ]
+    )
 
     client = endpoint.http_client()
     res = client.installed_extensions()
 
     info("Extensions list: %s", res)
     info("Extensions: %s", res["extensions"])
+    exts = extensions_by_name(res)
     # 'plpgsql' is a default extension that is always installed.
-    assert any(
-        ext["extname"] == "plpgsql" and ext["version"] == "1.0" for ext in res["extensions"]
-    ), "The 'plpgsql' extension is missing"
+    assert "1.0" in exts.get("plpgsql", {}), "The 'plpgsql' extension is missing"
 
     # check that the neon_test_utils extension is not installed
-    assert not any(
-        ext["extname"] == "neon_test_utils" for ext in res["extensions"]
-    ), "The 'neon_test_utils' extension is installed"
+    assert "neon_test_utils" not in exts, "The 'neon_test_utils' extension is installed"
 
     pg_conn = endpoint.connect(dbname="test_installed_extensions")
     with pg_conn.cursor() as cur:
-        cur.execute("CREATE EXTENSION neon_test_utils")
+        # Single round-trip, the result is the one of the last statement
         cur.execute(
+            "CREATE EXTENSION neon_test_utils;"
+            "CREATE EXTENSION neon version '1.1';"
             "SELECT default_version FROM pg_available_extensions WHERE name = 'neon_test_utils'"
         )
         res = cur.fetchone()
         neon_test_utils_version = res[0]
 
-    with pg_conn.cursor() as cur:
-        cur.execute("CREATE EXTENSION neon version '1.1'")
-
     pg_conn_2 = endpoint.connect(dbname="test_installed_extensions_2")
     with pg_conn_2.cursor() as cur:
         cur.execute("CREATE EXTENSION neon version '1.2'")
@@ -58,25 +70,20 @@ def test_installed_extensions(neon_simple_env: NeonEnv):
 
     info("Extensions list: %s", res)
     info("Extensions: %s", res["extensions"])
+    exts = extensions_by_name(res)
 
     # check that the neon_test_utils extension is installed only in 1 database
     # and has the expected version
-    assert any(
-        ext["extname"] == "neon_test_utils"
-        and ext["version"] == neon_test_utils_version
-        and ext["n_databases"] == 1
-        for ext in res["extensions"]
-    )
+    assert exts["neon_test_utils"][neon_test_utils_version]["n_databases"] == 1
 
     # check that the plpgsql extension is installed in all databases
     # this is a default extension that is always installed
-    assert any(ext["extname"] == "plpgsql" and ext["n_databases"] == 4 for ext in res["extensions"])
+    assert any(ext["n_databases"] == 4 for ext in exts["plpgsql"].values())
 
     # check that the neon extension is installed and has expected versions
-    for ext in res["extensions"]:
-        if ext["extname"] == "neon":
-            assert ext["version"] in ["1.1", "1.2"]
-            assert ext["n_databases"] == 1
+    for version, ext in exts.get("neon", {}).items():
+        assert version in ["1.1", "1.2"]
+        assert ext["n_databases"] == 1
 
     with pg_conn.cursor() as cur:
         cur.execute("ALTER EXTENSION neon UPDATE TO '1.3'")
@@ -85,12 +92,12 @@ def test_installed_extensions(neon_simple_env: NeonEnv):
 
     info("Extensions list: %s", res)
     info("Extensions: %s", res["extensions"])
+    exts = extensions_by_name(res)
 
     # check that the neon_test_utils extension is updated
-    for ext in res["extensions"]:
-        if ext["extname"] == "neon":
-            assert ext["version"] in ["1.2", "1.3"]
-            assert ext["n_databases"] == 1
+    for version, ext in exts.get("neon", {}).items():
+        assert version in ["1.2", "1.3"]
+        assert ext["n_databases"] == 1
 
     # check that /metrics endpoint is available
     # ensure that we see the metric before and after restart
@@ -2,18 +2,22 @@ from __future__ import annotations
 
 import json
 import random
+import re
 import threading
 import time
+from collections.abc import Iterator
+from contextlib import contextmanager
 
 import pytest
 import requests
 from fixtures.common_types import TenantId, TenantShardId, TimelineArchivalState, TimelineId
 from fixtures.log_helper import log
 from fixtures.neon_fixtures import (
+    LogCursor,
     NeonEnvBuilder,
     last_flush_lsn_upload,
 )
-from fixtures.pageserver.http import PageserverApiException
+from fixtures.pageserver.http import PageserverApiException, PageserverHttpClient
 from fixtures.pageserver.utils import (
     assert_prefix_empty,
     assert_prefix_not_empty,
@@ -21,13 +25,37 @@ from fixtures.pageserver.utils import (
     wait_until_tenant_active,
 )
 from fixtures.pg_version import PgVersion
-from fixtures.remote_storage import S3Storage, s3_storage
+from fixtures.remote_storage import TENANT_MANIFEST_PREFIX, S3Storage, s3_storage
 from fixtures.utils import run_only_on_default_postgres, skip_in_debug_build, wait_until
 from mypy_boto3_s3.type_defs import (
     ObjectTypeDef,
 )
 from psycopg2.errors import IoError, UndefinedTable
 
+# Offloading usually completes within a fraction of a second: start polling for it quickly,
+# and back off if it takes longer.
+OFFLOAD_POLL_INTERVAL = 0.05
+OFFLOAD_POLL_MAX_INTERVAL = 1.0
+
+
+@contextmanager
+def expect_pageserver_error(match: str, status_code: int | None = None) -> Iterator[None]:
+    """
+    Expect the block to raise a PageserverApiException matching `match`,
+    and if `status_code` is given, with that HTTP status.
+    """
+    with pytest.raises(PageserverApiException, match=match) as exc:
+        yield
+    if status_code is not None:
+        assert exc.value.status_code == status_code
+
+
+def timeline_offloaded(
+    ps_http: PageserverHttpClient, tenant_id: TenantId, timeline_id: TimelineId
+) -> bool:
+    listing = ps_http.timeline_and_offloaded_list(tenant_id=tenant_id)
+    return str(timeline_id) in {timeline["timeline_id"] for timeline in listing.offloaded}
+
 
 @pytest.mark.parametrize("shard_count", [0, 4])
 def test_timeline_archive(neon_env_builder: NeonEnvBuilder, shard_count: int):
@@ -44,29 +72,22 @@ def test_timeline_archive(neon_env_builder: NeonEnvBuilder, shard_count: int):
 
     # first try to archive a non existing timeline for an existing tenant:
     invalid_timeline_id = TimelineId.generate()
-    with pytest.raises(PageserverApiException, match="timeline not found") as exc:
+    with expect_pageserver_error("timeline not found", status_code=404):
         ps_http.timeline_archival_config(
             env.initial_tenant,
             invalid_timeline_id,
             state=TimelineArchivalState.ARCHIVED,
         )
 
-    assert exc.value.status_code == 404
-
     # for a non existing tenant:
     invalid_tenant_id = TenantId.generate()
-    with pytest.raises(
-        PageserverApiException,
-        match="NotFound: [tT]enant",
-    ) as exc:
+    with expect_pageserver_error("NotFound: [tT]enant", status_code=404):
         ps_http.timeline_archival_config(
             invalid_tenant_id,
             invalid_timeline_id,
             state=TimelineArchivalState.ARCHIVED,
         )
 
-    assert exc.value.status_code == 404
-
     # construct a pair of branches to validate that pageserver prohibits
     # archival of ancestor timelines when they have non-archived child branches
     parent_timeline_id = env.create_branch("test_ancestor_branch_archive_parent")
@@ -76,18 +97,15 @@ def test_timeline_archive(neon_env_builder: NeonEnvBuilder, shard_count: int):
         ancestor_branch_name="test_ancestor_branch_archive_parent",
     )
 
-    with pytest.raises(
-        PageserverApiException,
-        match="Cannot archive timeline which has non-archived child timelines",
-    ) as exc:
+    with expect_pageserver_error(
+        "Cannot archive timeline which has non-archived child timelines", status_code=412
+    ):
         ps_http.timeline_archival_config(
             env.initial_tenant,
             parent_timeline_id,
             state=TimelineArchivalState.ARCHIVED,
         )
 
-    assert exc.value.status_code == 412
-
     leaf_detail = ps_http.timeline_detail(
         env.initial_tenant,
         timeline_id=leaf_timeline_id,
@@ -113,10 +131,7 @@ def test_timeline_archive(neon_env_builder: NeonEnvBuilder, shard_count: int):
     )
 
     # Test that the leaf can't be unarchived
-    with pytest.raises(
-        PageserverApiException,
-        match="ancestor is archived",
-    ) as exc:
+    with expect_pageserver_error("ancestor is archived"):
         ps_http.timeline_archival_config(
             env.initial_tenant,
             leaf_timeline_id,
@@ -143,16 +158,17 @@ def test_timeline_offloading(neon_env_builder: NeonEnvBuilder, manual_offload: b
         # (automatic) timeline offloading defaults to false for now
         neon_env_builder.pageserver_config_override = "timeline_offloading = true"
 
-    env = neon_env_builder.init_start()
-    ps_http = env.pageserver.http_client()
-
-    # Turn off gc and compaction loops: we want to issue them manually for better reliability
-    tenant_id, initial_timeline_id = env.create_tenant(
-        conf={
+    # Turn off gc and compaction loops: we want to issue them manually for better reliability.
+    # Configure the initial tenant for that rather than creating another one.
+    env = neon_env_builder.init_start(
+        initial_tenant_conf={
             "gc_period": "0s",
             "compaction_period": "0s" if manual_offload else "1s",
         }
     )
+    ps_http = env.pageserver.http_client()
+    tenant_id = env.initial_tenant
+    initial_timeline_id = env.initial_timeline
 
     # Create three branches that depend on each other, starting with two
     grandparent_timeline_id = env.create_branch(
@@ -162,17 +178,19 @@ def test_timeline_offloading(neon_env_builder: NeonEnvBuilder, manual_offload: b
         "test_ancestor_branch_archive_parent", tenant_id, "test_ancestor_branch_archive_grandparent"
     )
 
-    # write some stuff to the parent
-    with env.endpoints.create_start(
-        "test_ancestor_branch_archive_parent", tenant_id=tenant_id
-    ) as endpoint:
+    # write some stuff to the parent. The endpoint is stopped while the parent gets archived
+    # and offloaded, and started again afterwards to check that the data is still there.
+    endpoint = env.endpoints.create("test_ancestor_branch_archive_parent", tenant_id=tenant_id)
+    with endpoint.start():
         endpoint.safe_psql_many(
             [
                 "CREATE TABLE foo(key serial primary key, t text default 'data_content')",
                 "INSERT INTO foo SELECT FROM generate_series(1,1000)",
             ]
         )
-        sum = endpoint.safe_psql("SELECT sum(key) from foo where key > 50")
+
+    # The keys are 1..=1000, so the checksum of the parent's data is known up front
+    expected_sum = sum(range(51, 1001))
 
     # create the third branch
     leaf_timeline_id = env.create_branch(
@@ -202,17 +220,24 @@ def test_timeline_offloading(neon_env_builder: NeonEnvBuilder, manual_offload: b
         state=TimelineArchivalState.ARCHIVED,
     )
 
+    offload_log_patterns: dict[TimelineId, re.Pattern[str]] = {}
+    offload_log_cursors: dict[TimelineId, LogCursor] = {}
+
     def timeline_offloaded_logged(timeline_id: TimelineId) -> bool:
-        return (
-            env.pageserver.log_contains(f".*{timeline_id}.* offloading archived timeline.*")
-            is not None
+        if timeline_id not in offload_log_patterns:
+            offload_log_patterns[timeline_id] = re.compile(
+                f"{timeline_id}.* offloading archived timeline"
+            )
+        # Only scan the part of the log appended since the last miss for this timeline
+        line, cursor = env.pageserver.log_tail_contains(
+            offload_log_patterns[timeline_id], offload_log_cursors.get(timeline_id)
         )
+        if line is None:
+            offload_log_cursors[timeline_id] = cursor
+        return line is not None
 
     if manual_offload:
-        with pytest.raises(
-            PageserverApiException,
-            match="timeline has attached children",
-        ):
+        with expect_pageserver_error("timeline has attached children"):
             # This only tests the (made for testing only) http handler,
             # but still demonstrates the constraints we have.
             ps_http.timeline_offload(tenant_id=tenant_id, timeline_id=parent_timeline_id)
@@ -227,13 +252,16 @@ def test_timeline_offloading(neon_env_builder: NeonEnvBuilder, manual_offload: b
             ps_http.timeline_offload(tenant_id=tenant_id, timeline_id=leaf_timeline_id)
         assert timeline_offloaded_logged(leaf_timeline_id)
 
-    wait_until(leaf_offloaded)
-    wait_until(parent_offloaded)
+    wait_until(
+        leaf_offloaded, interval=OFFLOAD_POLL_INTERVAL, max_interval=OFFLOAD_POLL_MAX_INTERVAL
+    )
+    wait_until(
+        parent_offloaded, interval=OFFLOAD_POLL_INTERVAL, max_interval=OFFLOAD_POLL_MAX_INTERVAL
+    )
 
     # Offloaded child timelines should still prevent deletion
-    with pytest.raises(
-        PageserverApiException,
-        match=f".* timeline which has child timelines: \\[{leaf_timeline_id}\\]",
+    with expect_pageserver_error(
+        f".* timeline which has child timelines: \\[{leaf_timeline_id}\\]"
     ):
         ps_http.timeline_delete(tenant_id, parent_timeline_id)
 
@@ -253,11 +281,9 @@ def test_timeline_offloading(neon_env_builder: NeonEnvBuilder, manual_offload: b
     )
     assert parent_detail["is_archived"] is False
 
-    with env.endpoints.create_start(
-        "test_ancestor_branch_archive_parent", tenant_id=tenant_id
-    ) as endpoint:
+    with endpoint.start():
         sum_again = endpoint.safe_psql("SELECT sum(key) from foo where key > 50")
-        assert sum == sum_again
+        assert sum_again[0][0] == expected_sum
 
     # Test that deletion of offloaded timelines works
     ps_http.timeline_delete(tenant_id, leaf_timeline_id)
@@ -284,29 +310,34 @@ def test_timeline_offload_persist(neon_env_builder: NeonEnvBuilder, delete_timel
             "checkpoint_distance": f"{1024 ** 2}",
         }
     )
+    tenant_prefix = f"tenants/{tenant_id}/"
+    tenant_manifest_prefix = f"{tenant_prefix}{TENANT_MANIFEST_PREFIX}"
 
     # Create a branch and archive it
     child_timeline_id = env.create_branch("test_archived_branch_persisted", tenant_id)
 
-    with env.endpoints.create_start(
-        "test_archived_branch_persisted", tenant_id=tenant_id
-    ) as endpoint:
+    # The endpoint is stopped while the branch is archived and offloaded, and possibly
+    # started again after unarchival.
+    endpoint = env.endpoints.create("test_archived_branch_persisted", tenant_id=tenant_id)
+    with endpoint.start():
         endpoint.safe_psql_many(
             [
                 "CREATE TABLE foo(key serial primary key, t text default 'data_content')",
-                "INSERT INTO foo SELECT FROM generate_series(1,2048)",
+                "INSERT INTO foo SELECT FROM generate_series(1,256)",
             ]
         )
-        sum = endpoint.safe_psql("SELECT sum(key) from foo where key < 500")
         last_flush_lsn_upload(env, endpoint, tenant_id, child_timeline_id)
 
+    # The keys are 1..=256, so the checksum of the branch's data is known up front
+    expected_sum = sum(range(1, 257))
+
     assert_prefix_not_empty(
         neon_env_builder.pageserver_remote_storage,
-        prefix=f"tenants/{str(tenant_id)}/",
+        prefix=tenant_prefix,
     )
     assert_prefix_empty(
         neon_env_builder.pageserver_remote_storage,
-        prefix=f"tenants/{str(tenant_id)}/tenant-manifest",
+        prefix=tenant_manifest_prefix,
     )
 
     ps_http.timeline_archival_config(
@@ -320,37 +351,35 @@ def test_timeline_offload_persist(neon_env_builder: NeonEnvBuilder, delete_timel
     )
     assert leaf_detail["is_archived"] is True
 
-    def timeline_offloaded_api(timeline_id: TimelineId) -> bool:
-        # TODO add a proper API to check if a timeline has been offloaded or not
-        return not any(
-            timeline["timeline_id"] == str(timeline_id)
-            for timeline in ps_http.timeline_list(tenant_id=tenant_id)
-        )
-
     def child_offloaded():
         ps_http.timeline_offload(tenant_id=tenant_id, timeline_id=child_timeline_id)
-        assert timeline_offloaded_api(child_timeline_id)
+        assert timeline_offloaded(ps_http, tenant_id, child_timeline_id)
 
-    wait_until(child_offloaded)
+    wait_until(
+        child_offloaded, interval=OFFLOAD_POLL_INTERVAL, max_interval=OFFLOAD_POLL_MAX_INTERVAL
+    )
 
-    assert timeline_offloaded_api(child_timeline_id)
-    assert not timeline_offloaded_api(root_timeline_id)
+    assert not timeline_offloaded(ps_http, tenant_id, root_timeline_id)
 
-    assert_prefix_not_empty(
-        neon_env_builder.pageserver_remote_storage,
-        prefix=f"tenants/{str(tenant_id)}/tenant-manifest",
-    )
+    # The offload must have been persisted in the tenant manifest
+    remote_storage = neon_env_builder.pageserver_remote_storage
+    assert isinstance(remote_storage, S3Storage)
+    manifest = remote_storage.download_tenant_manifest(tenant_id)
+    assert str(child_timeline_id) in {
+        timeline["timeline_id"] for timeline in manifest["offloaded_timelines"]
+    }
 
-    # Test persistence, is the timeline still offloaded?
-    env.pageserver.stop()
+    # Test persistence, is the timeline still offloaded after loading the manifest back?
+    # The manifest is already known to be uploaded, no need for a graceful shutdown.
+    env.pageserver.stop(immediate=True)
     env.pageserver.start()
 
-    assert timeline_offloaded_api(child_timeline_id)
-    assert not timeline_offloaded_api(root_timeline_id)
+    assert timeline_offloaded(ps_http, tenant_id, child_timeline_id)
+    assert not timeline_offloaded(ps_http, tenant_id, root_timeline_id)
 
     if delete_timeline:
         ps_http.timeline_delete(tenant_id, child_timeline_id)
-        with pytest.raises(PageserverApiException, match="not found"):
+        with expect_pageserver_error("not found"):
             ps_http.timeline_detail(
                 tenant_id,
                 child_timeline_id,
@@ -367,24 +396,22 @@ def test_timeline_offload_persist(neon_env_builder: NeonEnvBuilder, delete_timel
         )
         assert child_detail["is_archived"] is False
 
-        with env.endpoints.create_start(
-            "test_archived_branch_persisted", tenant_id=tenant_id
-        ) as endpoint:
-            sum_again = endpoint.safe_psql("SELECT sum(key) from foo where key < 500")
-            assert sum == sum_again
+        with endpoint.start():
+            sum_again = endpoint.safe_psql("SELECT sum(key) from foo")
+            assert sum_again[0][0] == expected_sum
 
         assert_prefix_empty(
             neon_env_builder.pageserver_remote_storage,
-            prefix=f"tenants/{str(env.initial_tenant)}/tenant-manifest",
+            prefix=f"tenants/{env.initial_tenant}/{TENANT_MANIFEST_PREFIX}",
         )
 
-    assert not timeline_offloaded_api(root_timeline_id)
+    assert not timeline_offloaded(ps_http, tenant_id, root_timeline_id)
 
     ps_http.tenant_delete(tenant_id)
 
     assert_prefix_empty(
         neon_env_builder.pageserver_remote_storage,
-        prefix=f"tenants/{str(tenant_id)}/",
+        prefix=tenant_prefix,
     )
 
 
@@ -771,7 +798,7 @@ def test_timeline_retain_lsn(
     if offload_child == "offload-corrupt":
         assert isinstance(env.pageserver_remote_storage, S3Storage)
         listing = list_prefix(
-            env.pageserver_remote_storage, f"tenants/{str(tenant_id)}/tenant-manifest"
+            env.pageserver_remote_storage, f"tenants/{tenant_id}/{TENANT_MANIFEST_PREFIX}"
         )
         objects: list[ObjectTypeDef] = listing.get("Contents", [])
         assert len(objects) > 0
@@ -887,7 +914,7 @@ def test_timeline_offload_generations(neon_env_builder: NeonEnvBuilder):
     )
     assert_prefix_empty(
         neon_env_builder.pageserver_remote_storage,
-        prefix=f"tenants/{str(tenant_id)}/tenant-manifest",
+        prefix=f"tenants/{tenant_id}/{TENANT_MANIFEST_PREFIX}",
     )
 
     ps_http.timeline_archival_config(
@@ -896,29 +923,21 @@ def test_timeline_offload_generations(neon_env_builder: NeonEnvBuilder):
         state=TimelineArchivalState.ARCHIVED,
     )
 
-    def timeline_offloaded_api(timeline_id: TimelineId) -> bool:
-        # TODO add a proper API to check if a timeline has been offloaded or not
-        return not any(
-            timeline["timeline_id"] == str(timeline_id)
-            for timeline in ps_http.timeline_list(tenant_id=tenant_id)
-        )
-
     def child_offloaded():
         ps_http.timeline_offload(tenant_id=tenant_id, timeline_id=child_timeline_id)
-        assert timeline_offloaded_api(child_timeline_id)
+        assert timeline_offloaded(ps_http, tenant_id, child_timeline_id)
 
     wait_until(child_offloaded)
 
-    assert timeline_offloaded_api(child_timeline_id)
-    assert not timeline_offloaded_api(root_timeline_id)
+    assert not timeline_offloaded(ps_http, tenant_id, root_timeline_id)
 
     # Reboot the pageserver a bunch of times, do unoffloads, offloads
     for i in range(5):
         env.pageserver.stop()
         env.pageserver.start()
 
-        assert timeline_offloaded_api(child_timeline_id)
-        assert not timeline_offloaded_api(root_timeline_id)
+        assert timeline_offloaded(ps_http, tenant_id, child_timeline_id)
+        assert not timeline_offloaded(ps_http, tenant_id, root_timeline_id)
 
         ps_http.timeline_archival_config(
             tenant_id,
@@ -926,7 +945,7 @@ def test_timeline_offload_generations(neon_env_builder: NeonEnvBuilder):
             state=TimelineArchivalState.UNARCHIVED,
         )
 
-        assert not timeline_offloaded_api(child_timeline_id)
+        assert not timeline_offloaded(ps_http, tenant_id, child_timeline_id)
 
         if i % 2 == 0:
             with env.endpoints.create_start(
@@ -1024,15 +1043,8 @@ def test_timeline_offload_race_unarchive(
         state=TimelineArchivalState.UNARCHIVED,
     )
 
-    def timeline_offloaded_api(timeline_id: TimelineId) -> bool:
-        # TODO add a proper API to check if a timeline has been offloaded or not
-        return not any(
-            timeline["timeline_id"] == str(timeline_id)
-            for timeline in ps_http.timeline_list(tenant_id=tenant_id)
-        )
-
     def leaf_offloaded():
-        assert timeline_offloaded_api(leaf_timeline_id)
+        assert timeline_offloaded(ps_http, tenant_id, leaf_timeline_id)
 
     # Ensure that we've hit the failed offload attempt
     ps_http.configure_failpoints((failpoint, "off"))